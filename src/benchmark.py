@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import random
+from datetime import datetime
+
+import numpy as np
+
+from database import QUERY_1, QUERY_2, QUERY_3, QUERY_5
+
+
+# Read-only queries that can be repeated without changing the graph.
+# Query 3 and 5 expect the USE and BUYING_FRIEND relationships to exist,
+# so run the benchmark after Database.query_3() and Database.query_4_3().
+QUERIES = {"query_1": QUERY_1,
+           "query_2": QUERY_2,
+           "query_3": QUERY_3,
+           "query_5": QUERY_5}
+
+# Same result as QUERY_2: the second MATCH expands from the grouped
+# terminal node instead of looking it up again by TERMINAL_ID, and the
+# relationships are matched by type instead of binding a variable.
+QUERY_2_REWRITE = (
+    "MATCH (term:Terminal)-[:EXECUTE]->(trans:Transaction) "
+    "WITH term, trans.TX_DATETIME.year AS year, "
+    "     CASE WHEN trans.TX_DATETIME.month < 7 THEN 'first' ELSE 'second' END AS semester, "
+    "     AVG(trans.TX_AMOUNT) AS avg_amount "
+    "MATCH (term)-[:EXECUTE]->(tr:Transaction) "
+    "WHERE (tr.TX_DATETIME.month < 7 AND year - 1 = tr.TX_DATETIME.year AND semester = 'second') OR "
+    "      (tr.TX_DATETIME.month >= 7 AND year = tr.TX_DATETIME.year AND semester = 'first') "
+    "      AND (tr.TX_AMOUNT > 1.1 * avg_amount OR tr.TX_AMOUNT < 0.9 * avg_amount) "
+    "RETURN term.TERMINAL_ID AS terminal, collect(tr.TRANSACTION_ID) AS transactions "
+    "ORDER BY terminal;"
+)
+
+
+def ratio(numerator, denominator):
+    # Server times are whole milliseconds and can be 0 on small datasets
+    if not denominator:
+        return None
+    return numerator / denominator
+
+
+def normalize(records):
+    # Order of rows and of collect() lists is not part of the result
+    def value(v):
+        if isinstance(v, list):
+            return sorted((value(x) for x in v), key=repr)
+        return v
+
+    rows = [[value(v) for v in record.values()] for record in records]
+    return sorted(rows, key=repr)
+
+
+def summarize(timings):
+    # A percentile needs enough samples above it to mean anything, with
+    # fewer it only interpolates between the slowest runs
+    timings = np.array(timings, dtype=float)
+    stats = {"min": float(timings.min()),
+             "median": float(np.median(timings))}
+    if len(timings) >= 20:
+        stats["p95"] = float(np.percentile(timings, 95))
+    if len(timings) >= 100:
+        stats["p99"] = float(np.percentile(timings, 99))
+    stats["max"] = float(timings.max())
+    return stats
+
+
+def describe(stats):
+    return ", ".join(f"{k} {v:.1f} ms" for k, v in stats.items())
+
+
+class Benchmark:
+
+    def __init__(self, db, size, warmup=3, repetitions=100):
+        if repetitions < 1:
+            raise ValueError("repetitions must be at least 1")
+        if warmup < 0:
+            raise ValueError("warmup must not be negative")
+
+        self.db = db
+        self.size = size
+        self.warmup = warmup
+        self.repetitions = repetitions
+        self.logger = db.logger
+        self.results = {"size": size,
+                        "warmup": warmup,
+                        "repetitions": repetitions,
+                        "started": datetime.now().isoformat(timespec="seconds"),
+                        "queries": {},
+                        "ab": {},
+                        "loader": []}
+
+    def _run_once(self, session, query):
+        # Server time is what Neo4j reports, client time also covers
+        # network transfer and record decoding in the driver
+        start = time.perf_counter()
+        result = session.run(query)
+        records = list(result)
+        summary = result.consume()
+        client = (time.perf_counter() - start) * 1000
+        server = summary.result_available_after + summary.result_consumed_after
+        return server, client, len(records)
+
+    def measure(self, name, query):
+        with self.db.driver.session() as session:
+            self.logger.info(f"Benchmark {name}: {self.warmup} warmup runs")
+            for _ in range(self.warmup):
+                self._run_once(session, query)
+
+            server_times, client_times = [], []
+            rows = 0
+            for _ in range(self.repetitions):
+                server, client, rows = self._run_once(session, query)
+                server_times.append(server)
+                client_times.append(client)
+
+        stats = {"rows": rows,
+                 "server_ms": summarize(server_times),
+                 "client_ms": summarize(client_times)}
+        self.logger.info(f"Benchmark {name}: "
+                         f"server {describe(stats['server_ms'])}; "
+                         f"client {describe(stats['client_ms'])}")
+        return stats
+
+    def run(self, queries=QUERIES):
+        for name, query in queries.items():
+            self.results["queries"][name] = self.measure(name, query)
+        return self.results["queries"]
+
+    def equivalent(self, query_a, query_b):
+        with self.db.driver.session() as session:
+            records_a = normalize(session.run(query_a))
+            records_b = normalize(session.run(query_b))
+        return records_a == records_b
+
+    def compare(self, name, query_a, query_b):
+        equivalent = self.equivalent(query_a, query_b)
+        if not equivalent:
+            self.logger.warning(
+                f"Benchmark {name}: A and B return different results")
+
+        # Each variant gets its own warmup, so B does not profit from A's cache
+        a = self.measure(f"{name} (A)", query_a)
+        b = self.measure(f"{name} (B)", query_b)
+        # Client time has sub-millisecond resolution, server time does not
+        speedup = ratio(a["client_ms"]["median"], b["client_ms"]["median"])
+        self.results["ab"][name] = {"A": a, "B": b,
+                                    "equivalent": equivalent,
+                                    "speedup": speedup}
+        if speedup is not None:
+            self.logger.info(
+                f"Benchmark {name}: B is {speedup:.2f}x the speed of A")
+        return self.results["ab"][name]
+
+    def loader_scaling(self, path, workers=(1, 2, 4, 8), repeats=3,
+                       batch_size=1000):
+        if repeats < 1:
+            raise ValueError("repeats must be at least 1")
+
+        self.logger.warning("Loader scaling reloads all transactions, the "
+                            "period and product properties set by query 4.1 "
+                            "and 4.2 are lost")
+
+        # One unrecorded load, so the first measured run does not pay for a
+        # cold page cache and later runs for reusing the space of deletes
+        self.db.delete_transaction()
+        self.db.load_transaction_parallel(path, max(workers), batch_size)
+
+        # Shuffled order, so no worker count is favoured by the state of the
+        # store left behind by the previous runs
+        order = [n for n in workers for _ in range(repeats)]
+        random.shuffle(order)
+        runs = {n: [] for n in workers}
+        for n in order:
+            self.db.delete_transaction()
+            runs[n].append(
+                self.db.load_transaction_parallel(path, n, batch_size))
+
+        loader = []
+        for n in workers:
+            throughput = float(np.median([r["throughput"] for r in runs[n]]))
+            loader.append({"workers": n,
+                           "throughput": throughput,
+                           "runs": runs[n]})
+
+        base = loader[0]["throughput"]
+        for entry in loader:
+            entry["speedup"] = ratio(entry["throughput"], base)
+            speedup = "n/a" if entry["speedup"] is None \
+                else f"{entry['speedup']:.2f}x"
+            self.logger.info(f"Loader with {entry['workers']} workers: "
+                             f"median {entry['throughput']:.0f} "
+                             f"transactions/s ({speedup})")
+
+        self.results["loader"] = loader
+        return loader
+
+    def save(self, dir_output):
+        if not os.path.exists(dir_output):
+            os.makedirs(dir_output)
+
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = f"{dir_output}/benchmark_{stamp}.json"
+        with open(path, "w") as f:
+            json.dump(self.results, f, indent=2)
+        self.logger.info(f"Benchmark results saved in {path}")
+        return path
+
+
+def compare_stats(old, new):
+    diff = {}
+    for stat in ("median", "p95"):
+        if stat in old and stat in new:
+            diff[stat] = {"before": old[stat],
+                          "after": new[stat],
+                          "change": ratio(new[stat] - old[stat], old[stat])}
+    return diff
+
+
+def compare_runs(path_old, path_new):
+    with open(path_old) as f:
+        old = json.load(f)
+    with open(path_new) as f:
+        new = json.load(f)
+
+    diff = {"queries": {}, "ab": {}, "loader": {}}
+    for name, stats in new["queries"].items():
+        if name not in old["queries"]:
+            continue
+        diff["queries"][name] = {
+            timing: compare_stats(old["queries"][name][timing], stats[timing])
+            for timing in ("server_ms", "client_ms")}
+
+    for name, ab in new["ab"].items():
+        if name not in old["ab"]:
+            continue
+        diff["ab"][name] = {"before": old["ab"][name]["speedup"],
+                            "after": ab["speedup"],
+                            "equivalent": ab.get("equivalent")}
+
+    loader_old = {run["workers"]: run["throughput"]
+                  for run in old.get("loader", [])}
+    for run in new.get("loader", []):
+        before = loader_old.get(run["workers"])
+        if before is None:
+            continue
+        diff["loader"][run["workers"]] = {
+            "before": before,
+            "after": run["throughput"],
+            "change": ratio(run["throughput"] - before, before)}
+    return diff
+
+
+def print_diff(diff):
+    def change(c):
+        return "n/a" if c is None else f"{c:+.1%}"
+
+    for name, timings in diff["queries"].items():
+        for timing, stats in timings.items():
+            for stat, d in stats.items():
+                print(f"{name:<12} {timing:<10} {stat:<7} "
+                      f"{d['before']:>10.1f} -> {d['after']:>10.1f} ms "
+                      f"({change(d['change'])})")
+
+    for name, d in diff["ab"].items():
+        before = "n/a" if d["before"] is None else f"{d['before']:.2f}x"
+        after = "n/a" if d["after"] is None else f"{d['after']:.2f}x"
+        print(f"{name:<12} A/B speedup {before} -> {after}, "
+              f"equivalent: {d['equivalent']}")
+
+    for workers, d in diff["loader"].items():
+        print(f"loader       {workers:>2} workers  {d['before']:>10.0f} -> "
+              f"{d['after']:>10.0f} transactions/s ({change(d['change'])})")
+
+
+if __name__ == "__main__":
+    # Usage: python src/benchmark.py old.json new.json
+    if len(sys.argv) != 3:
+        sys.exit("usage: benchmark.py OLD.json NEW.json")
+    print_diff(compare_runs(sys.argv[1], sys.argv[2]))
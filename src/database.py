@@ -1,8 +1,96 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from neo4j import GraphDatabase
+import pandas as pd
 import logging
 
 
+# Csv columns read by MERGE_TRANSACTION
+TRANSACTION_COLUMNS = ["TRANSACTION_ID", "TX_DATETIME", "TX_AMOUNT",
+                       "TX_FRAUD", "CUSTOMER_ID", "TERMINAL_ID"]
+
+# Converts a csv row bound to `row` and merges it into the graph, shared by
+# the LOAD CSV and the parallel UNWIND loader
+MERGE_TRANSACTION = (
+    "WITH toInteger(row.TRANSACTION_ID) AS TRANSACTION_ID, "
+    "     datetime(replace(row.TX_DATETIME,' ','T')) AS TX_DATETIME, "
+    "     toFloat(row.TX_AMOUNT) AS TX_AMOUNT, "
+    "     toInteger(row.TX_FRAUD) AS TX_FRAUD, "
+    "     toInteger(row.CUSTOMER_ID) AS CUSTOMER_ID, "
+    "     toInteger(row.TERMINAL_ID) AS TERMINAL_ID "
+    "WHERE TRANSACTION_ID IS NOT NULL "
+    "MATCH (terminal:Terminal { TERMINAL_ID: TERMINAL_ID }), "
+    "      (customer:Customer { CUSTOMER_ID: CUSTOMER_ID }) "
+    "MERGE (terminal)-[execute:EXECUTE]-> "
+    "      (t:Transaction { TRANSACTION_ID : TRANSACTION_ID, "
+    "                       TX_DATETIME : TX_DATETIME, "
+    "                       TX_AMOUNT : TX_AMOUNT, "
+    "                       TX_FRAUD : TX_FRAUD }) "
+    "      <-[make:MAKE]-(customer) "
+)
+
+LOAD_TRANSACTION_BATCH = "UNWIND $rows AS row " + MERGE_TRANSACTION
+
+
+def partition_transaction(transactions, workers):
+    # Bucket customers and terminals by id and pair the buckets as a latin
+    # square: in round r worker i gets customer bucket i and terminal bucket
+    # (i + r) % workers, so the batches of one round never lock the same node
+    customer_bucket = transactions.CUSTOMER_ID.astype(int) % workers
+    terminal_bucket = transactions.TERMINAL_ID.astype(int) % workers
+
+    rounds = []
+    for r in range(workers):
+        partitions = []
+        for i in range(workers):
+            mask = (customer_bucket == i) & (
+                terminal_bucket == (i + r) % workers)
+            partitions.append(transactions[mask].to_dict("records"))
+        rounds.append(partitions)
+    return rounds
+
+
+QUERY_1 = (
+    "MATCH (c:Customer)-[:MAKE]->(t:Transaction) "
+    "WHERE t.TX_DATETIME >= datetime({ year: datetime().year-1, month: CASE WHEN datetime().month < 7 THEN 1 ELSE 7 END, day: 1 }) "
+    "   AND t.TX_DATETIME < datetime({ year: datetime().year, month: CASE WHEN datetime().month < 7 THEN 7 ELSE 1 END, day: 1 }) "
+    "WITH c, t, datetime.truncate('week', t.TX_DATETIME) AS week "
+    "RETURN c.CUSTOMER_ID AS customer, sum(t.TX_AMOUNT) AS amount, week "
+    "ORDER BY customer, week;"
+)
+
+QUERY_2 = (
+    "MATCH (term:Terminal)-[EXECUTE]->(trans:Transaction) "
+    "WITH term, trans, trans.TX_DATETIME.year AS year, "
+    "     CASE WHEN trans.TX_DATETIME.month < 7 THEN 'first' ELSE 'second' END AS semester "
+    "WITH term.TERMINAL_ID AS terminal, year, semester, AVG(trans.TX_AMOUNT) AS avg_amount "
+    "MATCH (t:Terminal { TERMINAL_ID: terminal })-[EXECUTE]->(tr:Transaction) "
+    "WHERE (tr.TX_DATETIME.month < 7 AND year - 1 = tr.TX_DATETIME.year AND semester = 'second') OR "
+    "      (tr.TX_DATETIME.month >= 7 AND year = tr.TX_DATETIME.year AND semester = 'first') "
+    "      AND (tr.TX_AMOUNT > 1.1 * avg_amount OR tr.TX_AMOUNT < 0.9 * avg_amount) "
+    "RETURN terminal, collect(tr.TRANSACTION_ID) AS transactions "
+    "ORDER BY terminal;"
+)
+
+QUERY_3_CREATE_USE = (
+    "MATCH (terminal:Terminal)-[:EXECUTE]->(transaction:Transaction)<-[:MAKE]-(customer:Customer) "
+    "MERGE (customer)-[:USE]->(terminal);"
+)
+
+QUERY_3 = (
+    "MATCH path = (u1:Customer)-[:USE*4]-(u2:Customer) "
+    "WHERE id(u1) < id(u2) "
+    "RETURN DISTINCT u1.CUSTOMER_ID AS Customer1, u2.CUSTOMER_ID AS Customer2;"
+)
+
+QUERY_5 = (
+    "MATCH (user1:Customer)-[:BUYING_FRIEND*4]-(user2:Customer) "
+    "WHERE id(user1) < id(user2) "
+    "RETURN DISTINCT user1.CUSTOMER_ID, user2.CUSTOMER_ID;"
+)
+
+
 class Database:
 
     def __init__(self, uri, user, password, dir_output):
@@ -75,21 +163,7 @@ class Database:
                 "LOAD CSV WITH HEADERS FROM $path AS row "
                 "CALL { "
                 "    WITH row "
-                "    WITH toInteger(row.TRANSACTION_ID) AS TRANSACTION_ID, "
-                "         datetime(replace(row.TX_DATETIME,' ','T')) AS TX_DATETIME, "
-                "         toFloat(row.TX_AMOUNT) AS TX_AMOUNT, "
-                "         toInteger(row.TX_FRAUD) AS TX_FRAUD, "
-                "         toInteger(row.CUSTOMER_ID) AS CUSTOMER_ID, "
-                "         toInteger(row.TERMINAL_ID) AS TERMINAL_ID "
-                "    WHERE TRANSACTION_ID IS NOT NULL "
-                "    MATCH (terminal:Terminal { TERMINAL_ID: TERMINAL_ID }), "
-                "          (customer:Customer { CUSTOMER_ID: CUSTOMER_ID }) "
-                "    MERGE (terminal)-[execute:EXECUTE]-> "
-                "          (t:Transaction { TRANSACTION_ID : TRANSACTION_ID, "
-                "                           TX_DATETIME : TX_DATETIME, "
-                "                           TX_AMOUNT : TX_AMOUNT, "
-                "                           TX_FRAUD : TX_FRAUD }) "
-                "          <-[make:MAKE]-(customer) "
+                + MERGE_TRANSACTION +
                 "} IN TRANSACTIONS;"
             )
 
@@ -101,6 +175,70 @@ class Database:
             total_time = avail + cons
             self.logger.info(f"Time: {total_time} ms")
 
+    def _load_partition(self, rows, batch_size):
+        attempts = 0
+
+        def write_batch(tx, batch):
+            nonlocal attempts
+            attempts += 1
+            tx.run(LOAD_TRANSACTION_BATCH, rows=batch).consume()
+
+        # execute_write retries transient errors such as DeadlockDetected
+        with self.driver.session() as session:
+            batches = 0
+            for start in range(0, len(rows), batch_size):
+                session.execute_write(
+                    write_batch, rows[start:start + batch_size])
+                batches += 1
+        return attempts - batches
+
+    def load_transaction_parallel(self, path, workers=4, batch_size=1000):
+        # Unlike load_transaction the csv is read by the client, so path is
+        # a local file and not a file:/// url of the import directory
+        self.logger.info(
+            f"Load transaction csv from {path} with {workers} workers")
+        transactions = pd.read_csv(
+            path, usecols=TRANSACTION_COLUMNS, dtype=str)
+        rounds = partition_transaction(transactions, workers)
+
+        start_time = time.perf_counter()
+        retries = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for partitions in rounds:
+                # Wait for the whole round, the next one reuses the buckets
+                retries += sum(executor.map(
+                    lambda rows: self._load_partition(rows, batch_size),
+                    partitions))
+        total_time = (time.perf_counter() - start_time) * 1000
+
+        throughput = len(transactions) / max(total_time / 1000, 1e-9)
+        self.logger.info(f"Time: {total_time:.0f} ms")
+        self.logger.info(f"Throughput: {throughput:.0f} transactions/s, "
+                         f"{retries} retried batches")
+        return {"workers": workers,
+                "transactions": len(transactions),
+                "time_ms": total_time,
+                "throughput": throughput,
+                "retries": retries}
+
+    def delete_transaction(self):
+        with self.driver.session() as session:
+            query = (
+                "MATCH (t:Transaction) "
+                "CALL { "
+                "    WITH t "
+                "    DETACH DELETE t "
+                "} IN TRANSACTIONS;"
+            )
+
+            self.logger.info(f"Delete all transactions")
+            result = session.run(query)
+            summary = result.consume()
+            avail = summary.result_available_after
+            cons = summary.result_consumed_after
+            total_time = avail + cons
+            self.logger.info(f"Time: {total_time} ms")
+
     def index_customer(self):
         with self.driver.session() as session:
             query = (
@@ -148,14 +286,7 @@ class Database:
 
     def query_1(self):
         with self.driver.session() as session:
-            query = (
-                "MATCH (c:Customer)-[:MAKE]->(t:Transaction) "
-                "WHERE t.TX_DATETIME >= datetime({ year: datetime().year-1, month: CASE WHEN datetime().month < 7 THEN 1 ELSE 7 END, day: 1 }) "
-                "   AND t.TX_DATETIME < datetime({ year: datetime().year, month: CASE WHEN datetime().month < 7 THEN 7 ELSE 1 END, day: 1 }) "
-                "WITH c, t, datetime.truncate('week', t.TX_DATETIME) AS week "
-                "RETURN c.CUSTOMER_ID AS customer, sum(t.TX_AMOUNT) AS amount, week "
-                "ORDER BY customer, week;"
-            )
+            query = QUERY_1
 
             self.logger.info(f"Query 1")
             result = session.run(query)
@@ -172,18 +303,7 @@ class Database:
 
     def query_2(self):
         with self.driver.session() as session:
-            query = (
-                "MATCH (term:Terminal)-[EXECUTE]->(trans:Transaction) "
-                "WITH term, trans, trans.TX_DATETIME.year AS year, "
-                "     CASE WHEN trans.TX_DATETIME.month < 7 THEN 'first' ELSE 'second' END AS semester "
-                "WITH term.TERMINAL_ID AS terminal, year, semester, AVG(trans.TX_AMOUNT) AS avg_amount "
-                "MATCH (t:Terminal { TERMINAL_ID: terminal })-[EXECUTE]->(tr:Transaction) "
-                "WHERE (tr.TX_DATETIME.month < 7 AND year - 1 = tr.TX_DATETIME.year AND semester = 'second') OR "
-                "      (tr.TX_DATETIME.month >= 7 AND year = tr.TX_DATETIME.year AND semester = 'first') "
-                "      AND (tr.TX_AMOUNT > 1.1 * avg_amount OR tr.TX_AMOUNT < 0.9 * avg_amount) "
-                "RETURN terminal, collect(tr.TRANSACTION_ID) AS transactions "
-                "ORDER BY terminal;"
-            )
+            query = QUERY_2
 
             self.logger.info(f"Query 2")
             result = session.run(query)
@@ -200,10 +320,7 @@ class Database:
 
     def query_3(self):
         with self.driver.session() as session:
-            create_use = (
-                "MATCH (terminal:Terminal)-[:EXECUTE]->(transaction:Transaction)<-[:MAKE]-(customer:Customer) "
-                "MERGE (customer)-[:USE]->(terminal);"
-            )
+            create_use = QUERY_3_CREATE_USE
 
             self.logger.info(f"Create USE relationship")
             result = session.run(create_use)
@@ -214,11 +331,7 @@ class Database:
             total_time = avail + cons
             self.logger.info(f"Time: {total_time} ms")
 
-            query = (
-                "MATCH path = (u1:Customer)-[:USE*4]-(u2:Customer) "
-                "WHERE id(u1) < id(u2) "
-                "RETURN DISTINCT u1.CUSTOMER_ID AS Customer1, u2.CUSTOMER_ID AS Customer2;"
-            )
+            query = QUERY_3
 
             self.logger.info(f"Query 3")
             result = session.run(query)
@@ -309,11 +422,7 @@ class Database:
 
     def query_5(self):
         with self.driver.session() as session:
-            query = (
-                "MATCH (user1:Customer)-[:BUYING_FRIEND*4]-(user2:Customer) "
-                "WHERE id(user1) < id(user2) "
-                "RETURN DISTINCT user1.CUSTOMER_ID, user2.CUSTOMER_ID;"
-            )
+            query = QUERY_5
 
             self.logger.info(f"Query 5")
             result = session.run(query)
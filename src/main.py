@@ -1,6 +1,7 @@
-from database import Database
+from database import Database, QUERY_2
 from generator import generate_all_datasets, dir_error_handler
 from config import Config
+from benchmark import Benchmark, QUERY_2_REWRITE
 
 from logger import SetUpLogger
 import logging
@@ -11,6 +12,15 @@ DIR_DATA = "./data"
 DIR_OUTPUT = "./output"
 START_DATE = "2023-01-01"
 RADIUS = 5
+# The benchmark runs after the queries and reloads the transactions to
+# measure loader scaling, which drops the period and product properties
+# written by query 4.1 and 4.2
+BENCHMARK = False
+WARMUP = 3
+REPETITIONS = 100
+# 0 loads transactions with a single LOAD CSV stream
+LOAD_WORKERS = 0
+LOADER_SCALING = (1, 2, 4, 8)
 
 if __name__ == "__main__":
     # Set up logger settings
@@ -44,7 +54,11 @@ if __name__ == "__main__":
             db.load_terminal(f"file:///{size}/terminal.csv")
             db.index_terminal()
 
-            db.load_transaction(f"file:///{size}/transaction.csv")
+            if LOAD_WORKERS:
+                db.load_transaction_parallel(
+                    f"{DIR_DATA}/{size}/transaction.csv", LOAD_WORKERS)
+            else:
+                db.load_transaction(f"file:///{size}/transaction.csv")
             db.index_transaction()
 
             db.query_1()
@@ -55,5 +69,13 @@ if __name__ == "__main__":
             db.query_4_3()
             db.query_5()
 
+            if BENCHMARK:
+                bench = Benchmark(db, size, WARMUP, REPETITIONS)
+                bench.run()
+                bench.compare("query_2", QUERY_2, QUERY_2_REWRITE)
+                bench.loader_scaling(
+                    f"{DIR_DATA}/{size}/transaction.csv", LOADER_SCALING)
+                bench.save(f"{DIR_OUTPUT}/{size}")
+
         finally:
             db.close()